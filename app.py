@@ -18,6 +18,8 @@ from werkzeug.utils import secure_filename
 # 導入核心處理模組
 from evidence_pdf_converter import EvidencePDFConverter
 from batch_processor import BatchEvidenceProcessor
+from job_store import SQLiteJobStore
+from image_backends import get_default_image_backend
 
 app = Flask(__name__)
 
@@ -29,10 +31,15 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'evidence-pdf-converter-
 temp_dir = tempfile.gettempdir()
 app.config['UPLOAD_FOLDER'] = os.path.join(temp_dir, 'evidence_uploads')
 app.config['OUTPUT_FOLDER'] = os.path.join(temp_dir, 'evidence_output')
+# 任務狀態資料庫（多個 worker 共用，可查詢任一批次的處理結果）
+app.config['JOB_STATE_DB'] = os.environ.get('JOB_STATE_DB', os.path.join(temp_dir, 'evidence_jobs.db'))
 
 # 啟用 CORS
 CORS(app)
 
+# 啟動時解析圖片後端，EVIDENCE_IMAGE_BACKEND 設定錯誤時直接無法啟動
+get_default_image_backend()
+
 # 確保上傳和輸出目錄存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
@@ -46,7 +53,7 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def cleanup_old_files():
-    """清理超過 1 小時的舊檔案"""
+    """清理超過 1 小時的舊檔案及批次任務紀錄"""
     now = datetime.now()
     for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']]:
         for item in Path(folder).iterdir():
@@ -64,6 +71,17 @@ def cleanup_old_files():
             except Exception as e:
                 print(f"Error cleaning up {item}: {e}")
 
+    # 輸出檔案已刪除的批次，其任務紀錄一併刪除
+    store = None
+    try:
+        store = SQLiteJobStore(app.config['JOB_STATE_DB'])
+        store.purge_batches(now.timestamp() - 3600)
+    except Exception as e:
+        print(f"Error cleaning up job state: {e}")
+    finally:
+        if store is not None:
+            store.close()
+
 @app.route('/')
 def index():
     """首頁"""
@@ -73,6 +91,7 @@ def index():
 @app.route('/batch_process', methods=['POST'])
 def batch_process():
     """批次處理多個證據檔案"""
+    store = None
     try:
         if 'files' not in request.files:
             return jsonify({'error': '沒有選擇檔案'}), 400
@@ -106,7 +125,8 @@ def batch_process():
             return jsonify({'error': '沒有有效的檔案'}), 400
 
         # 使用 BatchEvidenceProcessor 處理
-        processor = BatchEvidenceProcessor()
+        store = SQLiteJobStore(app.config['JOB_STATE_DB'], batch_id)
+        processor = BatchEvidenceProcessor(store)
         for job_id, file_list in uploaded_files_map.items():
             processor.add_job(job_id, file_list, job_id, batch_output_folder)
 
@@ -142,6 +162,7 @@ def batch_process():
 
         return jsonify({
             'success': True,
+            'batch_id': batch_id,
             'results': results,
             'summary': f'{len(processed_files)}/{len(uploaded_files_map)} 個任務處理成功',
             'download_url': zip_download_url
@@ -149,6 +170,9 @@ def batch_process():
 
     except Exception as e:
         return jsonify({'error': f'批次處理失敗: {str(e)}'}), 500
+    finally:
+        if store is not None:
+            store.close()
 
 @app.route('/download_batch/<filename>')
 def download_batch(filename):
@@ -162,6 +186,32 @@ def download_batch(filename):
     except Exception as e:
         return jsonify({'error': f'下載失敗: {str(e)}'}), 500
 
+@app.route('/batch_status/<batch_id>')
+def batch_status(batch_id):
+    """查詢批次任務狀態"""
+    store = None
+    try:
+        store = SQLiteJobStore(app.config['JOB_STATE_DB'], batch_id)
+        jobs = BatchEvidenceProcessor(store).batch_jobs
+        if not jobs:
+            return jsonify({'error': '批次不存在'}), 404
+        return jsonify({
+            'batch_id': batch_id,
+            'jobs': {
+                job_id: {
+                    'status': job['status'],
+                    'filename': os.path.basename(job['output_file']) if job['output_file'] else None,
+                    'error': job['error']
+                }
+                for job_id, job in jobs.items()
+            }
+        })
+    except Exception as e:
+        return jsonify({'error': f'查詢失敗: {str(e)}'}), 500
+    finally:
+        if store is not None:
+            store.close()
+
 @app.route('/health')
 def health():
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()}), 200
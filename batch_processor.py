@@ -5,16 +5,36 @@
 """
 
 import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from typing import List, Dict, Tuple, Optional
 from evidence_pdf_converter import EvidencePDFConverter
+from job_store import JobStore, MemoryJobStore, SQLiteJobStore
 
 class BatchEvidenceProcessor:
     """批次證據文件處理器"""
     
-    def __init__(self):
+    def __init__(self, store: JobStore = None):
+        """
+        Args:
+            store: 任務狀態儲存（未指定時使用記憶體儲存；多行程共用時使用 SQLiteJobStore）
+        """
         self.converter = EvidencePDFConverter()
-        self.batch_jobs = {}  # 存儲批次任務
+        self.store = store if store is not None else MemoryJobStore()  # 存儲批次任務
+    
+    @property
+    def batch_jobs(self) -> Dict[str, Dict]:
+        """所有任務資料的快照（唯讀，更新請透過 store）"""
+        return self.store.get_all_jobs()
     
     def add_job(self, job_id: str, files: List[str], label_text: str, output_dir: str = None):
         """
@@ -29,31 +49,29 @@ class BatchEvidenceProcessor:
         if not files:
             return False
             
-        self.batch_jobs[job_id] = {
+        self.store.add_job(job_id, {
             'files': files,
             'label_text': label_text,
             'output_dir': output_dir,
             'status': 'pending',
             'output_file': None,
             'error': None
-        }
+        })
         return True
     
     def remove_job(self, job_id: str):
         """移除批次處理任務"""
-        if job_id in self.batch_jobs:
-            del self.batch_jobs[job_id]
-            return True
-        return False
+        return self.store.remove_job(job_id)
     
     def clear_all_jobs(self):
         """清空所有任務"""
-        self.batch_jobs.clear()
+        self.store.clear()
     
     def get_job_status(self, job_id: str) -> str:
         """取得任務狀態"""
-        if job_id in self.batch_jobs:
-            return self.batch_jobs[job_id]['status']
+        job = self.store.get_job(job_id)
+        if job is not None:
+            return job['status']
         return 'not_found'
     
     def get_all_jobs_status(self) -> Dict[str, str]:
@@ -61,7 +79,12 @@ class BatchEvidenceProcessor:
         return {job_id: job['status'] for job_id, job in self.batch_jobs.items()}
     
     def generate_batch_output_filename(self, job_id: str, files: List[str], output_dir: str = None) -> str:
-        """生成批次處理的輸出檔名"""
+        """
+        生成批次處理的輸出檔名
+        
+        Raises:
+            ValueError: 輸出檔案與任一輸入檔案相同（避免覆寫原始證據）
+        """
         if output_dir:
             output_path = Path(output_dir)
         else:
@@ -73,7 +96,27 @@ class BatchEvidenceProcessor:
         
         # 生成檔名
         filename = f"{job_id}.pdf"
-        return str(output_path / filename)
+        output_file = output_path / filename
+        
+        if any(output_file.resolve() == Path(f).resolve() for f in files):
+            raise ValueError(f"輸出檔案 {output_file} 與輸入檔案相同，請指定其他輸出目錄")
+        
+        return str(output_file)
+    
+    @contextmanager
+    def _batch_image_cache(self):
+        """批次期間使用的圖片快取目錄，結束時刪除（已有快取目錄時沿用）"""
+        if self.converter.image_cache_dir is not None:
+            yield self.converter.image_cache_dir
+            return
+        
+        cache_dir = tempfile.mkdtemp(prefix="evidence_batch_")
+        self.converter.image_cache_dir = cache_dir
+        try:
+            yield cache_dir
+        finally:
+            self.converter.image_cache_dir = None
+            shutil.rmtree(cache_dir, ignore_errors=True)
     
     def process_single_job(self, job_id: str) -> bool:
         """
@@ -82,12 +125,15 @@ class BatchEvidenceProcessor:
         Returns:
             bool: 處理成功返回True，失敗返回False
         """
-        if job_id not in self.batch_jobs:
+        job = self.store.get_job(job_id)
+        if job is None:
             return False
         
-        job = self.batch_jobs[job_id]
-        job['status'] = 'processing'
-        
+        self.store.update_job(job_id, status='processing')
+        return self._execute_job(job_id, job)
+    
+    def _execute_job(self, job_id: str, job: Dict) -> bool:
+        """執行已標記為處理中的任務並寫回結果"""
         try:
             # 生成輸出檔案路徑
             output_file = self.generate_batch_output_filename(
@@ -98,16 +144,13 @@ class BatchEvidenceProcessor:
             self.converter.convert(job['files'], output_file, job['label_text'])
             
             # 更新任務狀態
-            job['status'] = 'completed'
-            job['output_file'] = output_file
-            job['error'] = None
+            self.store.update_job(job_id, status='completed', output_file=output_file, error=None)
             
             return True
             
         except Exception as e:
             # 處理失敗
-            job['status'] = 'failed'
-            job['error'] = str(e)
+            self.store.update_job(job_id, status='failed', error=str(e))
             return False
     
     def process_all_jobs(self, progress_callback=None) -> Dict[str, bool]:
@@ -121,52 +164,192 @@ class BatchEvidenceProcessor:
             Dict[str, bool]: 各任務的處理結果
         """
         results = {}
-        total_jobs = len(self.batch_jobs)
+        job_ids = list(self.batch_jobs.keys())
+        total_jobs = len(job_ids)
         current_job = 0
         
-        for job_id in self.batch_jobs.keys():
-            current_job += 1
-            
-            # 呼叫進度回調
-            if progress_callback:
-                progress_callback(job_id, 'processing', current_job, total_jobs)
+        # 同一批次內相同的圖片只處理一次
+        with self._batch_image_cache():
+            for job_id in job_ids:
+                current_job += 1
+                
+                # 呼叫進度回調
+                if progress_callback:
+                    progress_callback(job_id, 'processing', current_job, total_jobs)
+                
+                # 處理任務
+                success = self.process_single_job(job_id)
+                results[job_id] = success
+                
+                # 呼叫完成回調
+                if progress_callback:
+                    status = 'completed' if success else 'failed'
+                    progress_callback(job_id, status, current_job, total_jobs)
+        
+        return results
+    
+    def process_queue(self, progress_callback=None, stale_after: float = None) -> Dict[str, bool]:
+        """
+        從共用佇列持續取出待處理任務直到佇列清空
+        
+        多個行程使用同一個 SQLiteJobStore 時，每個任務只會被其中一個行程處理。
+        
+        Args:
+            progress_callback: 進度回調函數 callback(job_id, status, current, total)，total 為目前已取得的任務數
+            stale_after: 處理中超過此秒數未更新的任務視為中斷，重新取得處理
             
-            # 處理任務
-            success = self.process_single_job(job_id)
-            results[job_id] = success
+        Returns:
+            Dict[str, bool]: 本行程處理的各任務結果
+        """
+        results = {}
+        
+        with self._batch_image_cache():
+            while True:
+                job_id = self.store.claim_next_job(stale_after)
+                if job_id is None:
+                    break
+                
+                current_job = len(results) + 1
+                if progress_callback:
+                    progress_callback(job_id, 'processing', current_job, current_job)
+                
+                success = self._execute_job(job_id, self.store.get_job(job_id))
+                results[job_id] = success
+                
+                if progress_callback:
+                    status = 'completed' if success else 'failed'
+                    progress_callback(job_id, status, current_job, current_job)
+        
+        return results
+    
+    def process_jobs_parallel(self, job_ids: List[str] = None, max_workers: int = None,
+                              progress_callback=None, stale_after: float = None) -> Dict[str, bool]:
+        """
+        以多行程平行處理任務
+        
+        任務在有空閒行程時才原子性地取得（待處理→處理中），已被其他行程取得的任務會略過，
+        因此多個程式可共用同一個 SQLiteJobStore 分攤處理。
+        
+        Args:
+            job_ids: 要處理的任務ID列表（未指定時持續從共用佇列取出待處理任務直到清空）
+            max_workers: 行程數（未指定時使用CPU核心數）
+            progress_callback: 進度回調函數 callback(job_id, status, current, total)，
+                               未指定 job_ids 時 total 為目前已取得的任務數
+            stale_after: 未指定 job_ids 時，處理中超過此秒數未更新的任務視為中斷，重新取得處理
             
-            # 呼叫完成回調
-            if progress_callback:
-                status = 'completed' if success else 'failed'
-                progress_callback(job_id, status, current_job, total_jobs)
+        Returns:
+            Dict[str, bool]: 本行程處理的各任務結果
+        """
+        max_workers = max_workers or os.cpu_count()
+        queue = deque(job_ids) if job_ids is not None else None
+        
+        def claim_next() -> Optional[str]:
+            if queue is None:
+                return self.store.claim_next_job(stale_after)
+            while queue:
+                job_id = queue.popleft()
+                if self.store.transition(job_id, 'pending', 'processing'):
+                    return job_id
+            return None
+        
+        results = {}
+        claimed = 0
+        current_job = 0
+        
+        # 各子行程共用同一個圖片快取目錄
+        with self._batch_image_cache() as cache_dir, ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            unfinished = set()  # 本行程已取得但尚未寫回結果的任務
+            try:
+                while True:
+                    # 補滿空閒行程
+                    while len(futures) < max_workers:
+                        job_id = claim_next()
+                        if job_id is None:
+                            break
+                        unfinished.add(job_id)
+                        claimed += 1
+                        total_jobs = len(job_ids) if job_ids is not None else claimed
+                        
+                        job = self.store.get_job(job_id)
+                        try:
+                            output_file = self.generate_batch_output_filename(
+                                job_id, job['files'], job['output_dir']
+                            )
+                        except ValueError as e:
+                            # 無法產生輸出路徑的任務直接標記失敗
+                            current_job += 1
+                            self.store.update_job(job_id, status='failed', error=str(e))
+                            unfinished.discard(job_id)
+                            results[job_id] = False
+                            if progress_callback:
+                                progress_callback(job_id, 'failed', current_job, total_jobs)
+                            continue
+                        future = executor.submit(
+                            _process_job_worker, job['files'], output_file, job['label_text'], cache_dir
+                        )
+                        futures[future] = (job_id, output_file)
+                    
+                    if not futures:
+                        break
+                    
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job_id, output_file = futures.pop(future)
+                        current_job += 1
+                        total_jobs = len(job_ids) if job_ids is not None else claimed
+                        
+                        try:
+                            error = future.result()
+                        except Exception as e:
+                            # 子行程異常終止
+                            error = str(e)
+                        
+                        if error is None:
+                            self.store.update_job(job_id, status='completed', output_file=output_file, error=None)
+                        else:
+                            self.store.update_job(job_id, status='failed', error=error)
+                        unfinished.discard(job_id)
+                        
+                        results[job_id] = error is None
+                        
+                        if progress_callback:
+                            status = 'completed' if error is None else 'failed'
+                            progress_callback(job_id, status, current_job, total_jobs)
+            except BaseException:
+                # 中斷（如 Ctrl+C）時將未完成的任務放回佇列，下次執行可立即接續
+                for job_id in unfinished:
+                    self.store.transition(job_id, 'processing', 'pending')
+                for future in futures:
+                    future.cancel()
+                raise
         
         return results
     
     def get_job_details(self, job_id: str) -> Optional[Dict]:
         """取得任務詳細資料"""
-        return self.batch_jobs.get(job_id)
+        return self.store.get_job(job_id)
     
     def get_completed_jobs(self) -> List[str]:
         """取得已完成的任務列表"""
-        return [job_id for job_id, job in self.batch_jobs.items() 
-                if job['status'] == 'completed']
+        return self.store.get_jobs_by_status('completed')
     
     def get_failed_jobs(self) -> List[str]:
         """取得失敗的任務列表"""
-        return [job_id for job_id, job in self.batch_jobs.items() 
-                if job['status'] == 'failed']
+        return self.store.get_jobs_by_status('failed')
     
     def get_pending_jobs(self) -> List[str]:
         """取得待處理的任務列表"""
-        return [job_id for job_id, job in self.batch_jobs.items() 
-                if job['status'] == 'pending']
+        return self.store.get_jobs_by_status('pending')
     
     def generate_summary_report(self) -> str:
         """生成處理結果摘要報告"""
-        total = len(self.batch_jobs)
-        completed = len(self.get_completed_jobs())
-        failed = len(self.get_failed_jobs())
-        pending = len(self.get_pending_jobs())
+        counts = self.store.count_by_status()
+        total = sum(counts.values())
+        completed = counts.get('completed', 0)
+        failed = counts.get('failed', 0)
+        pending = counts.get('pending', 0)
+        processing = counts.get('processing', 0)
         
         report = f"""批次處理結果摘要
 ===================
@@ -174,27 +357,45 @@ class BatchEvidenceProcessor:
 已完成：{completed}
 失敗：{failed}
 待處理：{pending}
-
+處理中：{processing}
 """
+        # 其他狀態也列出，確保各項總和等於總任務數
+        for status, count in counts.items():
+            if status not in ('completed', 'failed', 'pending', 'processing'):
+                report += f"{status}：{count}\n"
+        report += "\n"
         
         if completed > 0:
             report += "已完成的任務：\n"
             for job_id in self.get_completed_jobs():
-                job = self.batch_jobs[job_id]
+                job = self.store.get_job(job_id)
                 report += f"  ✓ {job_id} -> {job['output_file']}\n"
             report += "\n"
         
         if failed > 0:
             report += "失敗的任務：\n"
             for job_id in self.get_failed_jobs():
-                job = self.batch_jobs[job_id]
+                job = self.store.get_job(job_id)
                 report += f"  ✗ {job_id}: {job['error']}\n"
+            report += "\n"
+        
+        unfinished = {job_id: job['status'] for job_id, job in self.batch_jobs.items()
+                      if job['status'] not in ('completed', 'failed')}
+        if unfinished:
+            report += "未完成的任務：\n"
+            for job_id, status in unfinished.items():
+                report += f"  … {job_id}: {status}\n"
         
         return report
+    
+    def is_all_completed(self) -> bool:
+        """所有任務是否皆已完成"""
+        return all(status == 'completed' for status in self.store.count_by_status())
 
 
 def create_numbered_jobs(prefix: str, start_num: int, end_num: int, 
-                        files_dict: Dict[int, List[str]], output_dir: str = None) -> BatchEvidenceProcessor:
+                        files_dict: Dict[int, List[str]], output_dir: str = None,
+                        processor: BatchEvidenceProcessor = None) -> BatchEvidenceProcessor:
     """
     創建編號批次任務
     
@@ -204,11 +405,13 @@ def create_numbered_jobs(prefix: str, start_num: int, end_num: int,
         end_num: 結束編號
         files_dict: 檔案字典 {編號: [檔案列表]}
         output_dir: 輸出目錄
+        processor: 加入任務的既有處理器（未指定時建立新的處理器）
         
     Returns:
         BatchEvidenceProcessor: 配置好的批次處理器
     """
-    processor = BatchEvidenceProcessor()
+    if processor is None:
+        processor = BatchEvidenceProcessor()
     
     for num in range(start_num, end_num + 1):
         job_id = f"{prefix}{num}"
@@ -220,18 +423,258 @@ def create_numbered_jobs(prefix: str, start_num: int, end_num: int,
     return processor
 
 
-if __name__ == "__main__":
-    # 測試範例
-    processor = BatchEvidenceProcessor()
+def _process_job_worker(files: List[str], output_file: str, label_text: str,
+                        image_cache_dir: str = None) -> Optional[str]:
+    """
+    子行程中執行單一轉換
+    
+    Returns:
+        Optional[str]: 成功返回None，失敗返回錯誤訊息
+    """
+    try:
+        EvidencePDFConverter(image_cache_dir).convert(files, output_file, label_text)
+        return None
+    except Exception as e:
+        return str(e)
+
+
+# 批次CLI未指定輸出目錄時，輸出至案件資料夾下的此目錄
+DEFAULT_OUTPUT_DIRNAME = '_evidence_output'
+
+
+def scan_case_folder(root_dir: str, pattern: str, exclude_dirs: List[str] = None,
+                     exclude_files: List[str] = None) -> Dict[int, List[str]]:
+    """
+    掃描案件資料夾，依名稱規則取得各編號的檔案
+    
+    根目錄下的子資料夾或檔案名稱符合規則時，取第一個群組作為編號；
+    子資料夾內所有支援的檔案（依檔名排序）合併為同一份證據。
+    
+    Args:
+        root_dir: 案件資料夾
+        pattern: 名稱規則（正規表示式，第一個群組為編號，如：原證(\\d+)）
+        exclude_dirs: 不掃描的目錄（如輸出目錄）
+        exclude_files: 不掃描的檔案（如先前產生的輸出檔案）
+        
+    Returns:
+        Dict[int, List[str]]: 檔案字典 {編號: [檔案列表（絕對路徑）]}
+    """
+    converter = EvidencePDFConverter()
+    regex = re.compile(pattern)
+    excluded_dirs = [Path(d).resolve() for d in (exclude_dirs or [])]
+    excluded_files = {Path(f).resolve() for f in (exclude_files or [])}
+    files_dict = {}
+    
+    def is_excluded(path: Path) -> bool:
+        resolved = path.resolve()
+        return resolved in excluded_files or any(
+            resolved == d or resolved.is_relative_to(d) for d in excluded_dirs
+        )
     
-    # 添加測試任務
-    processor.add_job("原證1", ["test1.jpg"], "原證1")
-    processor.add_job("原證2", ["test2.jpg", "test3.jpg"], "原證2")
+    def is_supported(path: Path) -> bool:
+        return (path.is_file() and not is_excluded(path)
+                and (converter.is_image_file(str(path)) or converter.is_pdf_file(str(path))))
+    
+    for entry in sorted(Path(root_dir).iterdir()):
+        if is_excluded(entry):
+            continue
+        
+        name = entry.name if entry.is_dir() else entry.stem
+        match = regex.search(name)
+        if not match:
+            continue
+        
+        # 編號群組需為數字（群組可能為選擇性或比對到非數字）
+        number = match.group(1)
+        if number is None:
+            print(f"警告：{entry.name} 符合名稱規則，但未取得編號，略過")
+            continue
+        if not number.isdecimal():
+            print(f"警告：{entry.name} 符合名稱規則，但編號「{number}」不是數字，略過")
+            continue
+        
+        if entry.is_dir():
+            files = [os.path.abspath(f) for f in sorted(entry.rglob('*')) if is_supported(f)]
+        elif is_supported(entry):
+            files = [os.path.abspath(entry)]
+        else:
+            continue
+        
+        if files:
+            files_dict.setdefault(int(number), []).extend(files)
+    
+    return files_dict
+
+
+def load_manifest(manifest_path: str) -> Dict[str, Dict]:
+    """
+    讀取JSONL處理紀錄，同一任務以最後一筆紀錄為準
+    
+    Returns:
+        Dict[str, Dict]: {任務ID: 紀錄}
+    """
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中斷時可能留下不完整的最後一行
+                continue
+            records[record['job_id']] = record
+    
+    return records
+
+
+def append_manifest(manifest_path: str, record: Dict):
+    """追加一筆處理紀錄至JSONL檔案（立即寫入磁碟，以便中斷後續跑）"""
+    with open(manifest_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def main():
+    """批次處理程式進入點"""
+    parser = argparse.ArgumentParser(description='證據文件PDF批次轉換程式')
+    parser.add_argument('root', help='案件資料夾（其下的子資料夾或檔案依名稱規則對應證據編號）')
+    parser.add_argument('-p', '--prefix', default='原證', help='證據前綴（預設：原證）')
+    parser.add_argument('--pattern', help=r'名稱規則，第一個群組為編號（預設：前綴(\d+)）')
+    parser.add_argument('-m', '--map', action='append', default=[], metavar='PATTERN=PREFIX',
+                        help=r'額外的名稱規則與前綴對應，可重複指定（如：被證(\d+)=被證）')
+    parser.add_argument('-o', '--output-dir',
+                        help=f'輸出目錄（預設：案件資料夾下的 {DEFAULT_OUTPUT_DIRNAME}）')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='平行處理的行程數')
+    parser.add_argument('--manifest', help='處理紀錄檔（JSONL，預設：輸出目錄或案件資料夾下的 batch_manifest.jsonl）')
+    parser.add_argument('--state-db', help='任務狀態資料庫（SQLite，可供其他行程查詢進度）')
+    parser.add_argument('--batch-id', help='任務狀態資料庫中的批次ID（預設：案件資料夾的絕對路徑）')
+    parser.add_argument('--stale-after', type=float, default=3600,
+                        help='處理中超過此秒數未完成的任務視為中斷並重新處理（預設：3600）')
+    
+    args = parser.parse_args()
+    
+    if not os.path.isdir(args.root):
+        print(f"錯誤：資料夾 {args.root} 不存在")
+        sys.exit(1)
+    
+    if args.workers < 1:
+        print(f"錯誤：行程數需至少為 1：{args.workers}")
+        sys.exit(1)
+    
+    # 整理名稱規則與前綴
+    mappings = [(args.pattern or re.escape(args.prefix) + r'(\d+)', args.prefix)]
+    for item in args.map:
+        if '=' not in item:
+            print(f"錯誤：對應規則格式應為 PATTERN=PREFIX：{item}")
+            sys.exit(1)
+        pattern, prefix = item.rsplit('=', 1)
+        mappings.append((pattern, prefix))
+    
+    for pattern, _ in mappings:
+        try:
+            groups = re.compile(pattern).groups
+        except re.error as e:
+            print(f"錯誤：名稱規則 {pattern} 不是有效的正規表示式：{e}")
+            sys.exit(1)
+        if groups < 1:
+            print(f"錯誤：名稱規則 {pattern} 需要以括號標示編號群組，如：原證(\\d+)")
+            sys.exit(1)
+    
+    # 輸出至獨立目錄，避免覆寫或重複掃描到輸入檔案
+    output_dir = os.path.abspath(args.output_dir or os.path.join(args.root, DEFAULT_OUTPUT_DIRNAME))
+    manifest_path = os.path.abspath(args.manifest or os.path.join(output_dir, 'batch_manifest.jsonl'))
+    manifest_records = load_manifest(manifest_path)
+    
+    # 建立任務狀態儲存
+    store = None
+    if args.state_db:
+        Path(args.state_db).parent.mkdir(parents=True, exist_ok=True)
+        store = SQLiteJobStore(args.state_db, args.batch_id or os.path.abspath(args.root))
+    processor = BatchEvidenceProcessor(store)
+    previous_jobs = processor.store.get_all_jobs()
+    
+    # 依規則建立編號任務（略過輸出目錄與先前產生的輸出檔案；輸出目錄即案件資料夾時只能依檔案排除）
+    root_path = Path(args.root).resolve()
+    exclude_dirs = [] if root_path.is_relative_to(Path(output_dir)) else [output_dir]
+    exclude_files = [manifest_path] + [
+        record['output_file']
+        for record in list(previous_jobs.values()) + list(manifest_records.values())
+        if record.get('output_file')
+    ]
+    for pattern, prefix in mappings:
+        files_dict = scan_case_folder(args.root, pattern, exclude_dirs, exclude_files)
+        if files_dict:
+            create_numbered_jobs(prefix, min(files_dict), max(files_dict),
+                                 files_dict, output_dir, processor)
+    
+    all_jobs = processor.batch_jobs
+    if not all_jobs:
+        print("錯誤：沒有找到符合規則的檔案")
+        sys.exit(1)
+    
+    # 依處理紀錄（及狀態資料庫）略過已完成的任務，先前失敗的任務重新處理
+    Path(manifest_path).parent.mkdir(parents=True, exist_ok=True)
+    completed_records = dict(previous_jobs)
+    completed_records.update(manifest_records)
+    skipped = 0
+    for job_id, record in completed_records.items():
+        if (job_id in all_jobs and record.get('status') == 'completed'
+                and record.get('output_file') and os.path.exists(record['output_file'])):
+            processor.store.update_job(job_id, status='completed', output_file=record['output_file'])
+            skipped += 1
+    for job_id in processor.get_failed_jobs():
+        processor.store.transition(job_id, 'failed', 'pending', error=None)
+    
+    pending = processor.get_pending_jobs()
+    print(f"共 {len(all_jobs)} 個任務，略過已完成 {skipped} 個，待處理 {len(pending)} 個")
+    processing = processor.store.get_jobs_by_status('processing')
+    if processing:
+        print(f"警告：{len(processing)} 個任務處理中（其他行程處理中或先前中斷），"
+              f"超過 {args.stale_after:g} 秒未完成時才會重新處理：{', '.join(processing)}")
     
-    # 處理所有任務
     def progress_callback(job_id, status, current, total):
+        job = processor.get_job_details(job_id)
+        append_manifest(manifest_path, {
+            'job_id': job_id,
+            'status': status,
+            'files': [os.path.abspath(f) for f in job['files']],
+            'output_file': os.path.abspath(job['output_file']) if job['output_file'] else None,
+            'error': job['error'],
+            'timestamp': time.time()
+        })
         print(f"[{current}/{total}] {job_id}: {status}")
     
-    results = processor.process_all_jobs(progress_callback)
+    # 從佇列取得任務處理（共用狀態資料庫時可與其他行程分攤，並接手中斷的任務）
+    start_time = time.perf_counter()
+    try:
+        results = processor.process_jobs_parallel(None, args.workers, progress_callback, args.stale_after)
+    except KeyboardInterrupt:
+        print("\n已中斷：未完成的任務已放回佇列，重新執行即可接續處理")
+        sys.exit(130)
+    elapsed = time.perf_counter() - start_time
     
     print("\n" + processor.generate_summary_report())
+    
+    # 本行程的處理效能
+    processed = list(results)
+    input_files = sum(len(all_jobs[job_id]['files']) for job_id in processed)
+    input_bytes = sum(os.path.getsize(f) for job_id in processed for f in all_jobs[job_id]['files'])
+    if processed and elapsed > 0:
+        print(f"處理時間：{elapsed:.2f} 秒（{args.workers} 個行程）")
+        print(f"吞吐量：{len(processed) / elapsed:.2f} 任務/秒，"
+              f"{input_files / elapsed:.2f} 檔案/秒，"
+              f"{input_bytes / elapsed / (1024 * 1024):.2f} MB/秒")
+    
+    # 有任務失敗或未完成時以非零狀態結束
+    if not processor.is_all_completed():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+證據文件PDF轉換效能測試
+以合成的測試資料量測各處理流程的時間與輸出大小
+"""
+
+import os
+import io
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from typing import List, Dict, Callable
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4, A3, letter, landscape
+from PIL import Image, ImageChops, ImageStat
+from evidence_pdf_converter import EvidencePDFConverter
+from batch_processor import BatchEvidenceProcessor
+from image_backends import IMAGE_BACKENDS
+
+# 已註冊的效能測試 {名稱: 函數(工作目錄, 重複次數) -> 結果列表}
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """註冊效能測試"""
+    def decorator(func: Callable):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def make_pdf(path: str, pagesize, pages: int, rotation: int = 0):
+    """建立指定頁面尺寸與頁數的測試PDF"""
+    pdf_canvas = canvas.Canvas(path, pagesize=pagesize)
+    width, height = pagesize
+    for page_num in range(pages):
+        if page_num > 0:
+            pdf_canvas.showPage()
+        if rotation:
+            pdf_canvas.setPageRotation(rotation)
+        pdf_canvas.rect(20, 20, width - 40, height - 40)
+        for line in range(40):
+            pdf_canvas.drawString(40, height - 60 - line * 18, f"Page {page_num + 1} line {line + 1} " + "x" * 60)
+    pdf_canvas.save()
+
+
+def time_call(func: Callable, repeat: int) -> float:
+    """重複執行並返回最短時間（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_image(path: str, size, seed: int):
+    """建立具平滑紋理的測試圖片（壓縮難度接近掃描影像）"""
+    width, height = size
+    texture = Image.effect_noise((width // 8, height // 8), 60 + seed % 20)
+    image = texture.resize(size, Image.BILINEAR).convert('RGB')
+    image.save(path)
+
+
+def legacy_create_pdf_from_images(converter: EvidencePDFConverter, image_paths: List[str],
+                                  output_path: str, label_text: str):
+    """舊版流程：每張圖片各自解碼、編碼並嵌入（作為比較基準）"""
+    pdf_canvas = canvas.Canvas(output_path, pagesize=A4)
+    for i, image_path in enumerate(image_paths):
+        if i > 0:
+            pdf_canvas.showPage()
+        processed_image, _ = converter.process_image(image_path)
+        img_width, img_height, _ = converter.get_optimal_image_size(processed_image.width, processed_image.height)
+        temp_fd, temp_image_path = tempfile.mkstemp(suffix=".jpg")
+        os.close(temp_fd)
+        processed_image.save(temp_image_path, "JPEG", quality=95)
+        pdf_canvas.drawImage(temp_image_path, (converter.A4_WIDTH - img_width) / 2,
+                             (converter.A4_HEIGHT - img_height) / 2, width=img_width, height=img_height)
+        if i == 0:
+            converter.add_text_label(pdf_canvas, label_text)
+        os.remove(temp_image_path)
+    pdf_canvas.save()
+
+
+def legacy_process_existing_pdf(converter: EvidencePDFConverter, pdf_path: str, output_path: str, label_text: str):
+    """舊版流程：每一頁都疊加A4畫布，不考慮頁面尺寸（作為比較基準）"""
+    from PyPDF2 import PdfReader, PdfWriter
+
+    with open(pdf_path, 'rb') as input_file:
+        pdf_reader = PdfReader(input_file)
+        pdf_writer = PdfWriter()
+        for page_num, original_page in enumerate(pdf_reader.pages):
+            packet = io.BytesIO()
+            overlay_canvas = canvas.Canvas(packet, pagesize=A4)
+            if page_num == 0:
+                converter.add_text_label(overlay_canvas, label_text)
+            overlay_canvas.save()
+            packet.seek(0)
+            overlay_pdf = PdfReader(packet)
+            if len(overlay_pdf.pages) > 0:
+                original_page.merge_page(overlay_pdf.pages[0])
+            pdf_writer.add_page(original_page)
+        with open(output_path, 'wb') as output_file:
+            pdf_writer.write(output_file)
+
+
+@benchmark('pdf_passthrough')
+def bench_pdf_passthrough(work_dir: str, repeat: int) -> List[Dict]:
+    """既有PDF處理：A4快速路徑與非A4頁面正規化"""
+    converter = EvidencePDFConverter()
+    cases = [
+        ('A4', A4, 0),
+        ('Letter', letter, 0),
+        ('A3', A3, 0),
+        ('A4橫向', landscape(A4), 0),
+        ('Letter旋轉90', letter, 90),
+    ]
+    results = []
+
+    for name, pagesize, rotation in cases:
+        source = os.path.join(work_dir, f"pdf_{name}.pdf")
+        make_pdf(source, pagesize, pages=30, rotation=rotation)
+        input_size = os.path.getsize(source)
+
+        for variant, func in (
+            ('legacy', lambda out: legacy_process_existing_pdf(converter, source, out, "原證1")),
+            ('current', lambda out: converter.process_existing_pdf(source, out, "原證1")),
+        ):
+            output = os.path.join(work_dir, f"pdf_{name}_{variant}.pdf")
+            elapsed = time_call(lambda: func(output), repeat)
+            results.append({
+                'case': f"{name} ({variant})",
+                'seconds': elapsed,
+                'input_bytes': input_size,
+                'output_bytes': os.path.getsize(output),
+            })
+
+    return results
+
+
+@benchmark('image_dedup')
+def bench_image_dedup(work_dir: str, repeat: int) -> List[Dict]:
+    """批次內重複附件：10個證據各含1張獨立照片與同一份2頁附件（其中1頁為另存的相同檔案）"""
+    image_dir = os.path.join(work_dir, "dedup_images")
+    os.makedirs(image_dir, exist_ok=True)
+
+    shared = [os.path.join(image_dir, "contract_p1.png"), os.path.join(image_dir, "contract_p2.png")]
+    make_image(shared[0], (1600, 2200), 1)
+    make_image(shared[1], (1600, 2200), 2)
+    shared_copy = os.path.join(image_dir, "id_card_copy.png")
+    shutil.copyfile(shared[0], shared_copy)
+
+    jobs = {}
+    for num in range(1, 11):
+        photo = os.path.join(image_dir, f"photo_{num}.png")
+        make_image(photo, (1200, 900), num + 10)
+        jobs[f"原證{num}"] = [photo] + shared + [shared_copy]
+    input_size = sum(os.path.getsize(f) for files in jobs.values() for f in files)
+
+    legacy_dir = os.path.join(work_dir, "dedup_legacy")
+    current_dir = os.path.join(work_dir, "dedup_current")
+    os.makedirs(legacy_dir, exist_ok=True)
+
+    converter = EvidencePDFConverter()
+
+    def run_legacy():
+        for job_id, files in jobs.items():
+            legacy_create_pdf_from_images(converter, files, os.path.join(legacy_dir, f"{job_id}.pdf"), job_id)
+
+    def run_current():
+        processor = BatchEvidenceProcessor()
+        for job_id, files in jobs.items():
+            processor.add_job(job_id, files, job_id, current_dir)
+        processor.process_all_jobs()
+
+    results = []
+    for variant, func, output_dir in (('legacy', run_legacy, legacy_dir), ('current', run_current, current_dir)):
+        elapsed = time_call(func, repeat)
+        output_size = sum(os.path.getsize(os.path.join(output_dir, f)) for f in os.listdir(output_dir))
+        results.append({
+            'case': f"10個證據 ({variant})",
+            'seconds': elapsed,
+            'input_bytes': input_size,
+            'output_bytes': output_size,
+        })
+
+    return results
+
+
+def multiply_matrix(m1, m2):
+    """PDF轉換矩陣相乘（先套用m1再套用m2）"""
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (
+        a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+        c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+        e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2,
+    )
+
+
+def extract_page_images(pdf_path: str) -> List[List[Dict]]:
+    """
+    取得每頁所繪製的影像（位置、旋轉與像素）
+    返回: [[{'bbox', 'rotation', 'image'}, ...], ...]
+    """
+    from PyPDF2 import PdfReader
+    from PyPDF2.generic import ContentStream
+
+    reader = PdfReader(pdf_path)
+    pages = []
+    for page in reader.pages:
+        xobjects = page['/Resources'].get('/XObject', {})
+        ctm = (1, 0, 0, 1, 0, 0)
+        stack = []
+        images = []
+        for operands, operator in ContentStream(page.get_contents(), reader).operations:
+            if operator == b'q':
+                stack.append(ctm)
+            elif operator == b'Q':
+                ctm = stack.pop()
+            elif operator == b'cm':
+                ctm = multiply_matrix(tuple(float(v) for v in operands), ctm)
+            elif operator == b'Do':
+                xobject = xobjects[operands[0]].get_object()
+                if xobject.get('/Subtype') != '/Image':
+                    continue
+                a, b, c, d, e, f = ctm
+                corners = [(e, f), (a + e, b + f), (c + e, d + f), (a + c + e, b + d + f)]
+                images.append({
+                    'bbox': (min(x for x, _ in corners), min(y for _, y in corners),
+                             max(x for x, _ in corners), max(y for _, y in corners)),
+                    'rotation': 90 if abs(a) < 1e-6 and b > 0 else 0,
+                    'image': Image.open(io.BytesIO(xobject.get_data())),
+                })
+        pages.append(images)
+    return pages
+
+
+def check_equivalence(reference_pdf: str, candidate_pdf: str, position_tolerance: float = 0.5,
+                      pixel_tolerance: float = 4.0) -> List[str]:
+    """
+    比較兩份PDF的影像頁面是否等效：頁數、影像位置與大小、顯示方向與像素內容
+
+    Returns:
+        List[str]: 差異說明（空列表表示等效）
+    """
+    reference_pages = extract_page_images(reference_pdf)
+    candidate_pages = extract_page_images(candidate_pdf)
+    if len(reference_pages) != len(candidate_pages):
+        return [f"頁數不同：{len(reference_pages)} / {len(candidate_pages)}"]
+
+    problems = []
+    for page_num, (reference_images, candidate_images) in enumerate(zip(reference_pages, candidate_pages), 1):
+        if len(reference_images) != len(candidate_images):
+            problems.append(f"第{page_num}頁影像數不同")
+            continue
+        for reference, candidate in zip(reference_images, candidate_images):
+            if any(abs(r - c) > position_tolerance for r, c in zip(reference['bbox'], candidate['bbox'])):
+                problems.append(f"第{page_num}頁影像位置不同：{reference['bbox']} / {candidate['bbox']}")
+
+            # 轉為顯示方向後比較縮圖像素
+            shown = []
+            for item in (reference, candidate):
+                image = item['image'].convert('RGB')
+                if item['rotation']:
+                    image = image.rotate(item['rotation'], expand=True)
+                shown.append(image.resize((64, 64), Image.BILINEAR))
+            difference = max(ImageStat.Stat(ImageChops.difference(*shown)).mean)
+            if difference > pixel_tolerance:
+                problems.append(f"第{page_num}頁影像內容差異過大：{difference:.1f}")
+    return problems
+
+
+@benchmark('image_backends')
+def bench_image_backends(work_dir: str, repeat: int) -> List[Dict]:
+    """
+    圖片轉PDF後端：相機照片（JPEG直向/橫向）、灰階JPEG與掃描檔（PNG、CMYK JPEG、BMP），並驗證輸出等效
+    （CMYK JPEG與BMP無法直接嵌入，驗證重新編碼的路徑）
+    """
+    image_dir = os.path.join(work_dir, "backend_images")
+    os.makedirs(image_dir, exist_ok=True)
+
+    files = []
+    for num in range(8):
+        size = (2000, 1500) if num % 2 else (1500, 2000)
+        path = os.path.join(image_dir, f"photo_{num}.jpg")
+        make_image(path, size, num)
+        Image.open(path).convert('RGB').save(path, "JPEG", quality=90)
+        files.append(path)
+    for num in range(2):
+        size = (2000, 1500) if num % 2 else (1500, 2000)
+        path = os.path.join(image_dir, f"gray_{num}.jpg")
+        make_image(path, size, num + 10)
+        Image.open(path).convert('L').save(path, "JPEG", quality=90)
+        files.append(path)
+    for num in range(4):
+        path = os.path.join(image_dir, f"scan_{num}.png")
+        make_image(path, (1240, 1754), num + 20)
+        files.append(path)
+    path = os.path.join(image_dir, "scan_cmyk.jpg")
+    make_image(path, (1754, 1240), 30)
+    Image.open(path).convert('CMYK').save(path, "JPEG", quality=90)
+    files.append(path)
+    path = os.path.join(image_dir, "scan.bmp")
+    make_image(path, (1240, 1754), 31)
+    Image.open(path).save(path, "BMP")
+    files.append(path)
+    input_size = sum(os.path.getsize(f) for f in files)
+
+    results = []
+    outputs = {}
+    for name, backend_class in IMAGE_BACKENDS.items():
+        if not backend_class.is_available():
+            print(f"略過後端 {name}：所需套件未安裝")
+            continue
+        converter = EvidencePDFConverter(image_backend=name)
+        output = os.path.join(work_dir, f"backend_{name}.pdf")
+        elapsed = time_call(lambda: converter.convert(files, output, "原證1"), repeat)
+        outputs[name] = output
+        results.append({
+            'case': f"{len(files)}張圖片 ({name})",
+            'seconds': elapsed,
+            'input_bytes': input_size,
+            'output_bytes': os.path.getsize(output),
+        })
+
+    # 以預設後端為基準驗證其他後端的輸出
+    reference = outputs.get('pillow')
+    for row, name in zip(results, outputs):
+        if name != 'pillow' and reference:
+            problems = check_equivalence(reference, outputs[name])
+            row['problems'] = problems
+            row['note'] = "等效" if not problems else "不等效：" + "；".join(problems[:3])
+
+    return results
+
+
+def print_results(name: str, results: List[Dict]):
+    """輸出效能測試結果表格"""
+    print(f"\n== {name} ==")
+    print(f"{'案例':<28}{'時間(ms)':>12}{'輸入(KB)':>12}{'輸出(KB)':>12}")
+    for row in results:
+        print(f"{row['case']:<28}{row['seconds'] * 1000:>12.1f}"
+              f"{row['input_bytes'] / 1024:>12.1f}{row['output_bytes'] / 1024:>12.1f}"
+              f"  {row.get('note', '')}")
+
+
+def main():
+    """效能測試進入點"""
+    parser = argparse.ArgumentParser(description='證據文件PDF轉換效能測試')
+    parser.add_argument('names', nargs='*', help=f"要執行的測試（預設全部）：{', '.join(BENCHMARKS)}")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='每個案例重複次數（取最短時間）')
+    parser.add_argument('--keep', action='store_true', help='保留測試資料與輸出檔案')
+
+    args = parser.parse_args()
+
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"錯誤：未知的測試 {name}")
+            sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix='evidence_bench_')
+    failed = []
+    try:
+        for name in names:
+            results = BENCHMARKS[name](work_dir, args.repeat)
+            print_results(name, results)
+            failed += [row['case'] for row in results if row.get('problems')]
+    finally:
+        if args.keep:
+            print(f"\n測試資料：{work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # 輸出不等效時以非零狀態結束，供CI判斷
+    if failed:
+        print(f"\n錯誤：輸出不等效：{', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
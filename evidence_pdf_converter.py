@@ -5,25 +5,38 @@
 """
 
 import os
+import io
 import sys
+import shutil
+import hashlib
 import argparse
+import tempfile
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import List, Dict, Tuple, Union
 from PIL import Image, ImageDraw, ImageFont
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm, mm
 import PyPDF2
+from image_backends import get_image_backend, get_default_image_backend
 
 class EvidencePDFConverter:
     """證據文件PDF轉換器"""
     
-    def __init__(self):
+    def __init__(self, image_cache_dir: str = None, image_backend: str = None):
+        """
+        Args:
+            image_cache_dir: 編碼後圖片的快取目錄（可選，批次處理時由多個任務或行程共用）
+            image_backend: 圖片轉PDF後端名稱（未指定時依環境變數 EVIDENCE_IMAGE_BACKEND，預設 pillow）
+        """
+        self.image_cache_dir = image_cache_dir
+        self.image_backend = get_image_backend(image_backend) if image_backend else get_default_image_backend()
         self.A4_WIDTH = A4[0]  # 595.276 points
         self.A4_HEIGHT = A4[1]  # 841.890 points
         self.LABEL_WIDTH = 1 * cm  # 約28 points (修改為1cm寬)
         self.LABEL_HEIGHT = 3 * cm  # 約85 points (修改為3cm高)
         self.MARGIN = 0.5 * cm
+        self.A4_TOLERANCE = 1.0  # 判斷A4尺寸的容許誤差（points）
         
     def is_image_file(self, filepath: str) -> bool:
         """檢查是否為圖片檔案"""
@@ -185,51 +198,236 @@ class EvidencePDFConverter:
             unit_y = start_y - i * unit_height - font_size  # 從上往下排列
             pdf_canvas.drawString(unit_x, unit_y, unit)
     
+    def hash_file(self, filepath: str) -> str:
+        """計算檔案內容的SHA-256"""
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def write_file_atomic(self, path: str, data: bytes):
+        """以暫存檔加改名寫入，避免其他行程讀到寫到一半的檔案"""
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(temp_fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            # 寫入或改名失敗時移除暫存檔
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    def get_encoded_image(self, image_path: str, cache_dir: str) -> str:
+        """
+        取得圖片處理並編碼為JPEG後的檔案路徑，相同內容只處理一次
+        
+        來源檔案以內容雜湊對應至編碼結果（{來源雜湊}.ref），編碼結果以其本身的雜湊命名
+        （{編碼雜湊}.jpg），因此不同來源產生相同影像時也共用同一個檔案。
+        reportlab 以檔案路徑辨識圖片，同一路徑在同一份PDF中只嵌入一次。
+        """
+        source_hash = self.hash_file(image_path)
+        ref_path = os.path.join(cache_dir, f"{source_hash}.ref")
+        
+        if os.path.exists(ref_path):
+            with open(ref_path, 'r', encoding='ascii') as f:
+                encoded_path = os.path.join(cache_dir, f"{f.read().strip()}.jpg")
+            if os.path.exists(encoded_path):
+                return encoded_path
+        
+        # 處理圖片並編碼
+        processed_image, _ = self.process_image(image_path)
+        buffer = io.BytesIO()
+        processed_image.save(buffer, "JPEG", quality=95)
+        data = buffer.getvalue()
+        
+        encoded_hash = hashlib.sha256(data).hexdigest()
+        encoded_path = os.path.join(cache_dir, f"{encoded_hash}.jpg")
+        if not os.path.exists(encoded_path):
+            self.write_file_atomic(encoded_path, data)
+        self.write_file_atomic(ref_path, encoded_hash.encode('ascii'))
+        
+        return encoded_path
+    
     def create_pdf_from_images(self, image_paths: List[str], output_path: str, label_text: str):
         """從圖片建立PDF"""
-        pdf_canvas = canvas.Canvas(output_path, pagesize=A4)
+        # 未指定快取目錄時，使用僅限本次轉換的暫存目錄（仍可合併同一PDF內的重複圖片）
+        cache_dir = self.image_cache_dir
+        temp_cache_dir = None
+        if cache_dir is None:
+            temp_cache_dir = tempfile.mkdtemp(prefix="evidence_images_")
+            cache_dir = temp_cache_dir
         
-        for i, image_path in enumerate(image_paths):
-            if i > 0:  # 第一頁之後添加新頁面
-                pdf_canvas.showPage()
-            
-            # 處理圖片
-            processed_image, was_rotated = self.process_image(image_path)
-            
-            # 計算圖片在頁面上的位置和大小
-            img_width, img_height, _ = self.get_optimal_image_size(
-                processed_image.width, processed_image.height
-            )
-            
-            # 計算置中位置（圖片在整個頁面中央，可被標籤方塊覆蓋）
-            x = (self.A4_WIDTH - img_width) / 2
-            y = (self.A4_HEIGHT - img_height) / 2
-            
-            # 將PIL圖片轉換為reportlab可用的格式
-            temp_image_path = f"temp_image_{i}.jpg"
-            processed_image.save(temp_image_path, "JPEG", quality=95)
-            
-            # 在PDF中繪製圖片
-            pdf_canvas.drawImage(temp_image_path, x, y, width=img_width, height=img_height)
+        try:
+            self.image_backend.create_pdf(self, image_paths, output_path, label_text, cache_dir)
+        finally:
+            if temp_cache_dir:
+                shutil.rmtree(temp_cache_dir, ignore_errors=True)
+    
+    def analyze_page_geometry(self, page) -> Dict:
+        """
+        分析PDF頁面的幾何資訊（MediaBox與旋轉角度）
+        返回: {'width', 'height'（考慮旋轉後的顯示尺寸）, 'rotation', 'is_a4', 'is_landscape'}
+        """
+        mediabox = page.mediabox
+        width = float(mediabox.width)
+        height = float(mediabox.height)
+        rotation = (page.get('/Rotate', 0) or 0) % 360
+        
+        # 旋轉90或270度時，顯示尺寸的寬高互換
+        if rotation in (90, 270):
+            width, height = height, width
+        
+        # A4直向且原點在(0,0)、無旋轉時可直接使用
+        is_a4 = (
+            rotation == 0
+            and abs(width - self.A4_WIDTH) <= self.A4_TOLERANCE
+            and abs(height - self.A4_HEIGHT) <= self.A4_TOLERANCE
+            and abs(float(mediabox.left)) <= self.A4_TOLERANCE
+            and abs(float(mediabox.bottom)) <= self.A4_TOLERANCE
+        )
+        
+        return {
+            'width': width,
+            'height': height,
+            'rotation': rotation,
+            'is_a4': is_a4,
+            'is_landscape': width > height
+        }
+    
+    def normalize_page_to_a4(self, page, geometry: Dict):
+        """
+        以轉換矩陣將頁面內容縮放置中至A4直向頁面（不點陣化）
+        橫向頁面與圖片相同，逆時針旋轉90度
+        """
+        from PyPDF2 import Transformation
+        from PyPDF2.generic import ArrayObject, DecodedStreamObject, NameObject, NumberObject
+        
+        # 將 /Rotate（順時針顯示旋轉）轉為內容旋轉，橫向頁面再逆時針旋轉90度
+        angle = -geometry['rotation']
+        if geometry['is_landscape']:
+            angle += 90
+        rotate = Transformation().rotate(angle)
+        
+        # 計算旋轉後MediaBox的外框
+        mediabox = page.mediabox
+        corners = [
+            rotate.apply_on((float(x), float(y)))
+            for x in (mediabox.left, mediabox.right)
+            for y in (mediabox.bottom, mediabox.top)
+        ]
+        min_x = min(c[0] for c in corners)
+        min_y = min(c[1] for c in corners)
+        box_width = max(c[0] for c in corners) - min_x
+        box_height = max(c[1] for c in corners) - min_y
+        
+        # 等比例縮放至A4並置中（與圖片處理相同，不放大）
+        scale = min(self.A4_WIDTH / box_width, self.A4_HEIGHT / box_height, 1.0)
+        offset_x = (self.A4_WIDTH - box_width * scale) / 2
+        offset_y = (self.A4_HEIGHT - box_height * scale) / 2
+        
+        transformation = (
+            rotate
+            .translate(-min_x, -min_y)
+            .scale(scale, scale)
+            .translate(offset_x, offset_y)
+        )
+        # 以 q/cm/Q 包住原有內容，只解壓縮後串接，不解析內容運算子
+        matrix = self.format_pdf_matrix(transformation.ctm)
+        contents = page.get('/Contents')
+        original_data = b""
+        if contents is not None:
+            resolved = contents.get_object()
+            if isinstance(resolved, ArrayObject):
+                original_data = b"\n".join(stream.get_object().get_data() for stream in resolved)
+            else:
+                original_data = resolved.get_data()
+        
+        wrapped = DecodedStreamObject()
+        wrapped.set_data(f"q {matrix} cm\n".encode('ascii') + original_data + b"\nQ")
+        page[NameObject('/Contents')] = wrapped.flate_encode()
+        
+        # 註解（連結、標記等）的位置不受內容串流影響，需以相同矩陣轉換
+        self.transform_annotations(page, transformation)
+        
+        # 重設頁面框與旋轉
+        a4_box = self.pdf_rectangle(0, 0, self.A4_WIDTH, self.A4_HEIGHT)
+        page.mediabox = a4_box
+        page.cropbox = a4_box
+        for box_name in ('/TrimBox', '/BleedBox', '/ArtBox'):
+            if box_name in page:
+                del page[box_name]
+        page[NameObject('/Rotate')] = NumberObject(0)
+    
+    def transform_annotations(self, page, transformation):
+        """以轉換矩陣更新頁面註解的 /Rect 與 /QuadPoints"""
+        from PyPDF2.generic import ArrayObject, FloatObject, NameObject
+        
+        annotations = page.get('/Annots')
+        if annotations is None:
+            return
+        
+        for annotation in annotations.get_object():
+            annotation = annotation.get_object()
             
-            # 只在第一頁添加文字標籤
-            if i == 0:
-                self.add_text_label(pdf_canvas, label_text)
+            rect = annotation.get('/Rect')
+            if rect is not None:
+                left, bottom, right, top = (float(value) for value in rect)
+                corners = [transformation.apply_on((x, y)) for x in (left, right) for y in (bottom, top)]
+                annotation[NameObject('/Rect')] = self.pdf_rectangle(
+                    min(c[0] for c in corners), min(c[1] for c in corners),
+                    max(c[0] for c in corners), max(c[1] for c in corners)
+                )
             
-            # 清理暫存檔案
-            os.remove(temp_image_path)
+            quad_points = annotation.get('/QuadPoints')
+            if quad_points is not None:
+                values = [float(value) for value in quad_points]
+                points = [transformation.apply_on((values[i], values[i + 1])) for i in range(0, len(values) - 1, 2)]
+                annotation[NameObject('/QuadPoints')] = ArrayObject(
+                    FloatObject(self.format_pdf_number(coordinate, 4)) for point in points for coordinate in point
+                )
+    
+    def format_pdf_number(self, value: float, digits: int = 6) -> str:
+        """以定點小數表示數值，避免浮點誤差產生冗長數值"""
+        if abs(value) < 0.5 * 10 ** -digits:
+            return "0"
+        return f"{value:.{digits}f}".rstrip('0').rstrip('.')
+    
+    def format_pdf_matrix(self, matrix: Tuple[float, ...]) -> str:
+        """以定點小數表示轉換矩陣"""
+        return " ".join(self.format_pdf_number(value) for value in matrix)
+    
+    def pdf_rectangle(self, left: float, bottom: float, right: float, top: float):
+        """建立座標取至小數4位的 RectangleObject（PyPDF2 會以浮點數的完整十進位值寫出）"""
+        from PyPDF2.generic import FloatObject, RectangleObject
+        return RectangleObject([FloatObject(self.format_pdf_number(value, 4)) for value in (left, bottom, right, top)])
+    
+    def render_label_overlay(self, label_text: str) -> bytes:
+        """繪製只含標籤的A4頁面，返回PDF資料"""
+        packet = io.BytesIO()
+        overlay_canvas = canvas.Canvas(packet, pagesize=A4)
+        self.add_text_label(overlay_canvas, label_text)
+        overlay_canvas.save()
+        return packet.getvalue()
+    
+    def create_label_overlay(self, label_text: str):
+        """建立只含標籤的A4疊加PDF（返回PdfReader，合併期間需保持參照）"""
+        from PyPDF2 import PdfReader
         
-        pdf_canvas.save()
+        return PdfReader(io.BytesIO(self.render_label_overlay(label_text)))
     
     def process_existing_pdf(self, pdf_path: str, output_path: str, label_text: str):
-        """處理既有的PDF檔案，保留原始內容並添加標籤"""
+        """
+        處理既有的PDF檔案，保留原始內容並添加標籤
+        
+        A4直向頁面不做任何改寫直接複製；其他尺寸或旋轉的頁面以轉換矩陣
+        縮放至A4，確保標籤位置正確。
+        """
         try:
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.pagesizes import A4
             from PyPDF2 import PdfReader, PdfWriter
-            from reportlab.pdfbase import pdfmetrics
-            from reportlab.pdfbase.ttfonts import TTFont
-            import io
             
             # 讀取原始PDF
             with open(pdf_path, 'rb') as input_file:
@@ -237,26 +435,17 @@ class EvidencePDFConverter:
                 pdf_writer = PdfWriter()
                 
                 # 處理每一頁
-                for page_num in range(len(pdf_reader.pages)):
-                    original_page = pdf_reader.pages[page_num]
+                for page_num, original_page in enumerate(pdf_reader.pages):
+                    geometry = self.analyze_page_geometry(original_page)
                     
-                    # 創建一個新的PDF頁面來繪製標籤
-                    packet = io.BytesIO()
-                    overlay_canvas = canvas.Canvas(packet, pagesize=A4)
+                    # 非A4頁面需先正規化，A4頁面直接複製
+                    if not geometry['is_a4']:
+                        self.normalize_page_to_a4(original_page, geometry)
                     
-                    # 只在第一頁添加標籤
+                    # 只在第一頁疊加標籤
                     if page_num == 0:
-                        self.add_text_label(overlay_canvas, label_text)
-                    overlay_canvas.save()
-                    
-                    # 移動到緩衝區開始
-                    packet.seek(0)
-                    overlay_pdf = PdfReader(packet)
-                    
-                    # 只有當有標籤時才疊加
-                    if len(overlay_pdf.pages) > 0:
-                        overlay_page = overlay_pdf.pages[0]
-                        original_page.merge_page(overlay_page)
+                        overlay_pdf = self.create_label_overlay(label_text)
+                        original_page.merge_page(overlay_pdf.pages[0])
                     
                     pdf_writer.add_page(original_page)
                 
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+圖片轉PDF後端
+負責圖片「解碼→旋轉→編碼→嵌入」流程，可依部署環境選擇
+"""
+
+import io
+import os
+import hashlib
+from typing import List, Tuple
+from PIL import Image
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+
+class ImageBackend:
+    """圖片轉PDF後端介面"""
+
+    name = None
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """檢查後端所需的套件是否已安裝"""
+        return True
+
+    def create_pdf(self, converter, image_paths: List[str], output_path: str, label_text: str, cache_dir: str):
+        """
+        將圖片依序轉為A4頁面並在第一頁加上標籤
+
+        Args:
+            converter: EvidencePDFConverter（提供版面計算、圖片快取與標籤繪製）
+            image_paths: 圖片檔案列表
+            output_path: 輸出PDF路徑
+            label_text: 標籤文字
+            cache_dir: 編碼後圖片的快取目錄
+        """
+        raise NotImplementedError
+
+
+class PillowReportlabBackend(ImageBackend):
+    """預設後端：以Pillow解碼並重新編碼為JPEG，再由reportlab繪製頁面"""
+
+    name = 'pillow'
+
+    def create_pdf(self, converter, image_paths: List[str], output_path: str, label_text: str, cache_dir: str):
+        pdf_canvas = canvas.Canvas(output_path, pagesize=A4)
+
+        for i, image_path in enumerate(image_paths):
+            if i > 0:  # 第一頁之後添加新頁面
+                pdf_canvas.showPage()
+
+            # 處理圖片（相同內容的圖片只解碼、編碼一次）
+            encoded_path = converter.get_encoded_image(image_path, cache_dir)
+            with Image.open(encoded_path) as encoded_image:
+                encoded_width, encoded_height = encoded_image.size
+
+            # 計算圖片在頁面上的位置和大小
+            img_width, img_height, _ = converter.get_optimal_image_size(encoded_width, encoded_height)
+
+            # 計算置中位置（圖片在整個頁面中央，可被標籤方塊覆蓋）
+            x = (converter.A4_WIDTH - img_width) / 2
+            y = (converter.A4_HEIGHT - img_height) / 2
+
+            # 在PDF中繪製圖片
+            pdf_canvas.drawImage(encoded_path, x, y, width=img_width, height=img_height)
+
+            # 只在第一頁添加文字標籤
+            if i == 0:
+                converter.add_text_label(pdf_canvas, label_text)
+
+        pdf_canvas.save()
+
+
+class PikepdfBackend(ImageBackend):
+    """
+    直接嵌入後端：JPEG來源不解碼、不重新編碼，原始資料直接作為影像物件嵌入，
+    橫向圖片以頁面的轉換矩陣旋轉；其他格式仍以Pillow編碼為JPEG後嵌入。
+    需要安裝 pikepdf。
+    """
+
+    name = 'pikepdf'
+
+    # 可直接嵌入的JPEG色彩模式與對應的PDF色彩空間
+    COLOR_SPACES = {'RGB': '/DeviceRGB', 'L': '/DeviceGray'}
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return pikepdf is not None
+
+    def load_image(self, converter, image_path: str, cache_dir: str) -> Tuple[bytes, int, int, str, bool]:
+        """
+        取得要嵌入的JPEG資料
+        返回: (JPEG資料, 寬度, 高度, 色彩模式, 是否需要以矩陣旋轉)
+        """
+        with Image.open(image_path) as image:
+            if image.format == 'JPEG' and image.mode in self.COLOR_SPACES:
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+                # 與預設後端相同：橫向圖片逆時針旋轉90度
+                return data, image.width, image.height, image.mode, image.width > image.height
+
+        encoded_path = converter.get_encoded_image(image_path, cache_dir)
+        with open(encoded_path, 'rb') as f:
+            data = f.read()
+        with Image.open(encoded_path) as encoded_image:
+            return data, encoded_image.width, encoded_image.height, encoded_image.mode, False
+
+    def create_pdf(self, converter, image_paths: List[str], output_path: str, label_text: str, cache_dir: str):
+        pdf = pikepdf.Pdf.new()
+        xobjects = {}  # {JPEG雜湊: 影像物件}，同一PDF中相同影像只嵌入一次
+        overlay_pdf = None
+
+        try:
+            for i, image_path in enumerate(image_paths):
+                data, width, height, mode, rotate = self.load_image(converter, image_path, cache_dir)
+
+                key = hashlib.sha256(data).hexdigest()
+                if key not in xobjects:
+                    xobjects[key] = pdf.make_indirect(pikepdf.Stream(
+                        pdf, data,
+                        Type=pikepdf.Name.XObject,
+                        Subtype=pikepdf.Name.Image,
+                        Width=width,
+                        Height=height,
+                        ColorSpace=pikepdf.Name(self.COLOR_SPACES[mode]),
+                        BitsPerComponent=8,
+                        Filter=pikepdf.Name.DCTDecode,
+                    ))
+
+                # 旋轉後的顯示尺寸與置中位置
+                display_width, display_height = (height, width) if rotate else (width, height)
+                img_width, img_height, _ = converter.get_optimal_image_size(display_width, display_height)
+                x = (converter.A4_WIDTH - img_width) / 2
+                y = (converter.A4_HEIGHT - img_height) / 2
+
+                # 影像單位正方形對應到頁面的矩陣（旋轉時為逆時針90度）
+                if rotate:
+                    matrix = (0, img_height, -img_width, 0, x + img_width, y)
+                else:
+                    matrix = (img_width, 0, 0, img_height, x, y)
+
+                page = pdf.add_blank_page(page_size=(converter.A4_WIDTH, converter.A4_HEIGHT))
+                page.obj.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=xobjects[key]))
+                page.obj.Contents = pdf.make_stream(
+                    f"q {converter.format_pdf_matrix(matrix)} cm /Im0 Do Q".encode('ascii')
+                )
+
+                # 只在第一頁添加文字標籤
+                if i == 0:
+                    overlay_pdf = pikepdf.open(io.BytesIO(converter.render_label_overlay(label_text)))
+                    page.add_overlay(overlay_pdf.pages[0])
+
+            pdf.save(output_path)
+        finally:
+            if overlay_pdf is not None:
+                overlay_pdf.close()
+            pdf.close()
+
+
+# 可用的後端 {名稱: 類別}
+IMAGE_BACKENDS = {
+    PillowReportlabBackend.name: PillowReportlabBackend,
+    PikepdfBackend.name: PikepdfBackend,
+}
+
+
+# 已解析的後端 {名稱: 後端}，每個名稱只檢查（及警告）一次
+_resolved_backends = {}
+
+
+def get_image_backend(name: str = None) -> ImageBackend:
+    """
+    依名稱取得後端，未指定或所需套件未安裝時使用預設後端
+
+    Args:
+        name: 後端名稱（pillow、pikepdf）
+    """
+    name = name or PillowReportlabBackend.name
+    if name in _resolved_backends:
+        return _resolved_backends[name]
+
+    if name not in IMAGE_BACKENDS:
+        raise ValueError(f"未知的圖片後端：{name}（可用：{', '.join(IMAGE_BACKENDS)}）")
+
+    backend_class = IMAGE_BACKENDS[name]
+    if not backend_class.is_available():
+        print(f"警告：圖片後端 {name} 所需套件未安裝，使用預設後端")
+        backend_class = PillowReportlabBackend
+
+    _resolved_backends[name] = backend_class()
+    return _resolved_backends[name]
+
+
+def get_default_image_backend() -> ImageBackend:
+    """取得環境變數 EVIDENCE_IMAGE_BACKEND 指定的後端（未設定時使用 pillow）"""
+    return get_image_backend(os.environ.get('EVIDENCE_IMAGE_BACKEND'))
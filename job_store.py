@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+批次任務狀態儲存
+提供記憶體與SQLite兩種後端，SQLite後端可供多個行程共用同一批次佇列
+"""
+
+import os
+import json
+import time
+import sqlite3
+from typing import List, Dict, Optional
+
+# 任務欄位（不含任務ID）
+JOB_FIELDS = ('files', 'label_text', 'output_dir', 'status', 'output_file', 'error')
+# 任務定義欄位（重複新增同一任務時只更新這些欄位）
+JOB_DEFINITION_FIELDS = ('files', 'label_text', 'output_dir')
+
+
+class JobStore:
+    """任務狀態儲存介面"""
+
+    def add_job(self, job_id: str, job: Dict):
+        """
+        新增任務；任務已存在時只更新檔案、標籤與輸出目錄，保留處理狀態與結果
+        （避免其他行程正在處理或已完成的任務被重設）
+        """
+        raise NotImplementedError
+
+    def remove_job(self, job_id: str) -> bool:
+        """移除任務"""
+        raise NotImplementedError
+
+    def clear(self):
+        """清空所有任務"""
+        raise NotImplementedError
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """取得任務資料（不存在時返回None）"""
+        raise NotImplementedError
+
+    def get_all_jobs(self) -> Dict[str, Dict]:
+        """依加入順序取得所有任務"""
+        raise NotImplementedError
+
+    def get_jobs_by_status(self, status: str) -> List[str]:
+        """依加入順序取得指定狀態的任務ID"""
+        raise NotImplementedError
+
+    def count_by_status(self) -> Dict[str, int]:
+        """統計各狀態的任務數"""
+        raise NotImplementedError
+
+    def update_job(self, job_id: str, **fields) -> bool:
+        """更新任務欄位"""
+        raise NotImplementedError
+
+    def transition(self, job_id: str, from_status: str, to_status: str, **fields) -> bool:
+        """
+        原子性狀態轉換：僅當任務目前狀態為 from_status 時才更新
+
+        Returns:
+            bool: 轉換成功返回True，狀態不符或任務不存在返回False
+        """
+        raise NotImplementedError
+
+    def claim_next_job(self, stale_after: float = None) -> Optional[str]:
+        """
+        原子性地取出下一個待處理任務並標記為處理中
+
+        Args:
+            stale_after: 秒數；處理中超過此時間未更新的任務視為行程已中斷，可重新取得
+                         （應大於單一任務的最長處理時間）
+        """
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    """記憶體任務儲存（僅限單一行程）"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.status_index = {}  # {狀態: {任務ID: None}}，依進入該狀態的順序排列
+        self.order = {}  # {任務ID: 加入序號}
+        self.updated_at = {}  # {任務ID: 最後更新時間}
+        self._seq = 0
+
+    def _index_remove(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            self.status_index.get(job['status'], {}).pop(job_id, None)
+
+    def _index_add(self, job_id: str):
+        self.status_index.setdefault(self.jobs[job_id]['status'], {})[job_id] = None
+
+    def add_job(self, job_id: str, job: Dict):
+        if job_id in self.jobs:
+            self.update_job(job_id, **{field: job.get(field) for field in JOB_DEFINITION_FIELDS})
+            return
+        self._seq += 1
+        self.order[job_id] = self._seq
+        self.jobs[job_id] = {field: job.get(field) for field in JOB_FIELDS}
+        self.updated_at[job_id] = time.time()
+        self._index_add(job_id)
+
+    def remove_job(self, job_id: str) -> bool:
+        if job_id not in self.jobs:
+            return False
+        self._index_remove(job_id)
+        del self.jobs[job_id]
+        del self.order[job_id]
+        del self.updated_at[job_id]
+        return True
+
+    def clear(self):
+        self.jobs.clear()
+        self.status_index.clear()
+        self.order.clear()
+        self.updated_at.clear()
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        job = self.jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def get_all_jobs(self) -> Dict[str, Dict]:
+        return {job_id: dict(job) for job_id, job in self.jobs.items()}
+
+    def get_jobs_by_status(self, status: str) -> List[str]:
+        # 索引內的順序為進入該狀態的順序，依加入順序輸出以與SQLite後端一致
+        return sorted(self.status_index.get(status, {}), key=self.order.get)
+
+    def count_by_status(self) -> Dict[str, int]:
+        return {status: len(ids) for status, ids in self.status_index.items() if ids}
+
+    def update_job(self, job_id: str, **fields) -> bool:
+        if job_id not in self.jobs:
+            return False
+        self._index_remove(job_id)
+        self.jobs[job_id].update({k: v for k, v in fields.items() if k in JOB_FIELDS})
+        self.updated_at[job_id] = time.time()
+        self._index_add(job_id)
+        return True
+
+    def transition(self, job_id: str, from_status: str, to_status: str, **fields) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job['status'] != from_status:
+            return False
+        return self.update_job(job_id, status=to_status, **fields)
+
+    def claim_next_job(self, stale_after: float = None) -> Optional[str]:
+        # 只取索引的第一個任務，不排序整個佇列：待處理索引依加入（或放回佇列）的順序，
+        # 處理中索引依最後更新的順序，第一個即為最久未更新的任務
+        candidates = []
+        pending = next(iter(self.status_index.get('pending', {})), None)
+        if pending is not None:
+            candidates.append(pending)
+        if stale_after is not None:
+            oldest = next(iter(self.status_index.get('processing', {})), None)
+            if oldest is not None and self.updated_at[oldest] < time.time() - stale_after:
+                candidates.append(oldest)
+        if not candidates:
+            return None
+        job_id = min(candidates, key=self.order.get)
+        self.update_job(job_id, status='processing')
+        return job_id
+
+
+class SQLiteJobStore(JobStore):
+    """
+    SQLite任務儲存
+
+    每個批次以 batch_id 區分，同一資料庫可由多個行程同時存取；
+    狀態轉換以條件式UPDATE完成，確保同一任務只會被一個行程取得。
+    """
+
+    def __init__(self, db_path: str, batch_id: str = 'default', timeout: float = 30.0):
+        self.db_path = db_path
+        self.batch_id = batch_id
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 連線不可跨行程共用（fork後需重新連線）
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                batch_id TEXT NOT NULL,
+                job_id TEXT NOT NULL,
+                files TEXT NOT NULL,
+                label_text TEXT,
+                output_dir TEXT,
+                status TEXT NOT NULL,
+                output_file TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (batch_id, job_id)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (batch_id, status)")
+
+    def _row_to_job(self, row: sqlite3.Row) -> Dict:
+        job = {field: row[field] for field in JOB_FIELDS}
+        job['files'] = json.loads(job['files'])
+        return job
+
+    def _encode_fields(self, fields: Dict) -> Dict:
+        values = {k: v for k, v in fields.items() if k in JOB_FIELDS}
+        if 'files' in values:
+            values['files'] = json.dumps(values['files'], ensure_ascii=False)
+        return values
+
+    def add_job(self, job_id: str, job: Dict):
+        values = self._encode_fields({field: job.get(field) for field in JOB_FIELDS})
+        self._connect().execute("""
+            INSERT INTO jobs (batch_id, job_id, files, label_text, output_dir, status, output_file, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (batch_id, job_id) DO UPDATE SET
+                files = excluded.files, label_text = excluded.label_text, output_dir = excluded.output_dir
+        """, (self.batch_id, job_id, values['files'], values['label_text'], values['output_dir'],
+              values['status'], values['output_file'], values['error'], time.time()))
+
+    def remove_job(self, job_id: str) -> bool:
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE batch_id = ? AND job_id = ?", (self.batch_id, job_id)
+        )
+        return cursor.rowcount > 0
+
+    def clear(self):
+        self._connect().execute("DELETE FROM jobs WHERE batch_id = ?", (self.batch_id,))
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT * FROM jobs WHERE batch_id = ? AND job_id = ?", (self.batch_id, job_id)
+        ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def get_all_jobs(self) -> Dict[str, Dict]:
+        rows = self._connect().execute(
+            "SELECT * FROM jobs WHERE batch_id = ? ORDER BY rowid", (self.batch_id,)
+        ).fetchall()
+        return {row['job_id']: self._row_to_job(row) for row in rows}
+
+    def get_jobs_by_status(self, status: str) -> List[str]:
+        rows = self._connect().execute(
+            "SELECT job_id FROM jobs WHERE batch_id = ? AND status = ? ORDER BY rowid",
+            (self.batch_id, status)
+        ).fetchall()
+        return [row['job_id'] for row in rows]
+
+    def count_by_status(self) -> Dict[str, int]:
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) AS n FROM jobs WHERE batch_id = ? GROUP BY status", (self.batch_id,)
+        ).fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def _update(self, job_id: str, fields: Dict, where_status: str = None) -> bool:
+        values = self._encode_fields(fields)
+        assignments = ", ".join(f"{k} = ?" for k in values)
+        params = list(values.values()) + [time.time(), self.batch_id, job_id]
+        sql = f"UPDATE jobs SET {assignments + ', ' if assignments else ''}updated_at = ? WHERE batch_id = ? AND job_id = ?"
+        if where_status is not None:
+            sql += " AND status = ?"
+            params.append(where_status)
+        return self._connect().execute(sql, params).rowcount > 0
+
+    def update_job(self, job_id: str, **fields) -> bool:
+        return self._update(job_id, fields)
+
+    def transition(self, job_id: str, from_status: str, to_status: str, **fields) -> bool:
+        return self._update(job_id, dict(fields, status=to_status), where_status=from_status)
+
+    def claim_next_job(self, stale_after: float = None) -> Optional[str]:
+        conn = self._connect()
+        # 以寫入鎖包住查詢與更新，避免多個行程取得同一任務
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if stale_after is None:
+                row = conn.execute(
+                    "SELECT job_id FROM jobs WHERE batch_id = ? AND status = 'pending' ORDER BY rowid LIMIT 1",
+                    (self.batch_id,)
+                ).fetchone()
+            else:
+                # 處理中但長時間未更新的任務（行程已中斷）可重新取得
+                row = conn.execute("""
+                    SELECT job_id FROM jobs
+                    WHERE batch_id = ? AND (status = 'pending' OR (status = 'processing' AND updated_at < ?))
+                    ORDER BY rowid LIMIT 1
+                """, (self.batch_id, time.time() - stale_after)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            self._update(row['job_id'], {'status': 'processing'})
+            conn.execute("COMMIT")
+            return row['job_id']
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge_batches(self, older_than: float) -> int:
+        """
+        刪除資料庫中所有最後更新早於指定時間的批次（不限於本批次）
+
+        Args:
+            older_than: 時間戳記（秒）
+
+        Returns:
+            int: 刪除的任務數
+        """
+        cursor = self._connect().execute("""
+            DELETE FROM jobs WHERE batch_id IN (
+                SELECT batch_id FROM jobs GROUP BY batch_id HAVING MAX(updated_at) < ?
+            )
+        """, (older_than,))
+        return cursor.rowcount
+
+    def close(self):
+        """關閉資料庫連線"""
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None